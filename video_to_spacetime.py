@@ -2,17 +2,44 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from mpl_toolkits.mplot3d import Axes3D
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
 from matplotlib.widgets import RadioButtons, Button, TextBox
 import cv2
 from PIL import Image
 import os
-import imageio
+import queue
+import threading
+import time
+import imageio.v3 as iio
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None  # Fall back to NumPy normalization
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _normalize_volume(volume_u8, channel_min, inv_range, out, out_ytx, out_txy):
+        """Normalize a uint8 volume to float32 and fill both transposed layouts in one pass"""
+        n_time, height, width, channels = volume_u8.shape
+        for t in prange(n_time):
+            for y in range(height):
+                for x in range(width):
+                    for c in range(channels):
+                        value = (volume_u8[t, y, x, c] - channel_min[c]) * inv_range[c]
+                        out[t, y, x, c] = value
+                        out_ytx[x, t, y, c] = value
+                        out_txy[y, t, x, c] = value
+else:
+    _normalize_volume = None
+
 
 class SpaceTimeVisualizer:
     def __init__(self, file_path):
         # Load video/gif and convert to space-time volume
         self.file_path = file_path
-        frames = self._load_media()
+        self.volume_u8, channel_min, channel_max = self._load_media()  # (time, height, width, channels)
         
         # Try to detect original FPS if it's a video file
         self.fps = 20  # Default FPS
@@ -30,17 +57,33 @@ class SpaceTimeVisualizer:
         # Frame interval in milliseconds
         self.interval = 1000 / self.fps
         
-        # Create space-time volume and normalize
-        self.volume = np.stack(frames, axis=0)  # (time, height, width, channels)
-        self.volume = self.volume.astype(float)
-        # Normalize each channel separately
-        for c in range(self.volume.shape[-1]):
-            channel = self.volume[..., c]
-            channel_min, channel_max = channel.min(), channel.max()
-            if channel_max > channel_min:
-                self.volume[..., c] = (channel - channel_min) / (channel_max - channel_min)
-        
-        self.time, self.height, self.width, self.channels = self.volume.shape
+        # Normalize each channel separately using the ranges gathered while loading,
+        # scaling by the reciprocal range so the full-volume pass only multiplies
+        channel_min = channel_min.astype(np.float32)
+        channel_max = channel_max.astype(np.float32)
+        channel_range = np.where(channel_max > channel_min, channel_max - channel_min, 1.0)
+        inv_range = (1.0 / channel_range).astype(np.float32)
+        
+        self.time, self.height, self.width, self.channels = self.volume_u8.shape
+        
+        # Create the normalized space-time volume along with contiguous transposed copies
+        # so each view slices along its leading axis
+        if _normalize_volume is not None:
+            self.volume = np.empty(self.volume_u8.shape, dtype=np.float32)
+            self._vol_ytx = np.empty((self.width, self.time, self.height, self.channels), dtype=np.float32)
+            self._vol_txy = np.empty((self.height, self.time, self.width, self.channels), dtype=np.float32)
+            _normalize_volume(self.volume_u8, channel_min, inv_range, self.volume, self._vol_ytx, self._vol_txy)
+        else:
+            self.volume = self.volume_u8.astype(np.float32, order='C')
+            self.volume -= channel_min
+            self.volume *= inv_range
+            self._vol_ytx = np.ascontiguousarray(self.volume.transpose(2, 0, 1, 3))  # (width, time, height, channels)
+            self._vol_txy = np.ascontiguousarray(self.volume.transpose(1, 0, 2, 3))  # (height, time, width, channels)
+        
+        # Every frame handed to imshow or the exporter is a leading-axis slice of one of these
+        for vol in (self.volume_u8, self.volume, self._vol_ytx, self._vol_txy):
+            assert vol.flags['C_CONTIGUOUS']
+        
         print(f"Media dimensions: Time={self.time}, Height={self.height}, Width={self.width}, Channels={self.channels}")
         print(f"Playback rate: {self.fps:.1f} FPS (can be adjusted with text input)")
         print(f"Note: Actual maximum FPS is limited by your hardware capabilities")
@@ -55,6 +98,30 @@ class SpaceTimeVisualizer:
         # Create small 3D axis in the corner
         self.ax_3d = plt.axes([0.02, 0.6, 0.15, 0.35], projection='3d')
         
+        # Unit cube wireframe edges as (12 segments, 2 endpoints, xyz)
+        self._box_edges = np.array([
+            edge for i in (0, 1) for j in (0, 1)
+            for edge in ([[0, j, i], [1, j, i]], [[j, 0, i], [j, 1, i]], [[j, i, 0], [j, i, 1]])
+        ], dtype=float)
+        
+        # The cube never changes, so draw the 3D axes once; only the scanning plane moves
+        self.ax_3d.view_init(elev=20, azim=45)
+        self._setup_3d_axes()
+        self._plot_3d_box()
+        self._plane_surf = None
+        
+        # Smallest plane movement worth reprojecting, refreshed on every draw
+        self._plane_min_step = 0.0
+        
+        # The plane is blitted separately from the animation, only every few frames;
+        # the stride adapts so 3D redraws take at most a share of each frame's budget
+        self._bg_3d = None
+        self._3d_stride = 1
+        self._3d_max_stride = 10
+        self._3d_budget = 0.25
+        self._3d_cost = None  # Smoothed seconds per 3D redraw
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        
         # Add radio buttons for dimension selection
         rax = plt.axes([0.02, 0.25, 0.15, 0.15])
         self.radio = RadioButtons(rax, ('X-Y-T', 'Y-T-X', 'T-X-Y'))
@@ -78,104 +145,252 @@ class SpaceTimeVisualizer:
         self.frame = 0
         self.anim = None
         
+        # Per-view animation steps, swapped in by dimension_changed
+        self._update_fns = {
+            'X-Y-T': self._update_xyt,
+            'Y-T-X': self._update_ytx,
+            'T-X-Y': self._update_txy,
+        }
+        self._update_fn = self._update_fns[self.current_view]
+        
+        # Factors mapping a frame index onto [0,1] along each axis
+        self._inv_tm1 = 1.0 / max(self.time - 1, 1)
+        self._inv_wm1 = 1.0 / max(self.width - 1, 1)
+        self._inv_hm1 = 1.0 / max(self.height - 1, 1)
+        
         # Store base name for exports
         self.base_name = os.path.splitext(os.path.basename(file_path))[0]
 
     def _load_media(self):
-        """Load frames from either video or gif file"""
+        """Load frames from either video or gif file.
+        
+        Returns the (time, height, width, channels) uint8 volume along with the
+        per-channel minimum and maximum values.
+        """
         _, ext = os.path.splitext(self.file_path)
-        frames = []
         
         if ext.lower() == '.gif':
-            # Load GIF using PIL
+            # Load GIF using PIL, decoding straight into a preallocated volume
             gif = Image.open(self.file_path)
+            n_frames = getattr(gif, 'n_frames', 1)
+            first = np.asarray(gif.convert('RGB'))
+            volume = np.empty((n_frames,) + first.shape, dtype=np.uint8)
+            volume[0] = first
+            for i in range(1, n_frames):
+                gif.seek(i)
+                # Convert to RGB
+                volume[i] = np.asarray(gif.convert('RGB'))
+            channel_min = volume.min(axis=(0, 1, 2))
+            channel_max = volume.max(axis=(0, 1, 2))
+        else:
+            volume, channel_min, channel_max = self._load_video()
+            
+        return volume, channel_min, channel_max
+    
+    def _load_video(self, n_slots=4):
+        """Load video frames using OpenCV, decoding on a background thread.
+        
+        The reader thread decodes into a small ring of buffers while this thread
+        copies finished frames into the volume and accumulates the channel ranges.
+        """
+        cap = cv2.VideoCapture(self.file_path)
+        # The reported frame count is only a sizing hint; the frame shape comes from
+        # the first decoded frame since reported dimensions can be missing or wrong
+        n_estimate = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 1)
+        ret, first = cap.read()
+        if not ret:
+            cap.release()
+            raise ValueError(f"Could not load frames from {self.file_path}")
+        volume = np.empty((n_estimate,) + first.shape, dtype=np.uint8)
+        volume[0] = first[..., ::-1]  # Convert from BGR to RGB
+        
+        slots = np.empty((n_slots,) + first.shape, dtype=np.uint8)
+        free_slots = queue.Queue()
+        filled_slots = queue.Queue()
+        for i in range(n_slots):
+            free_slots.put(i)
+        
+        def read_frames():
             try:
                 while True:
-                    # Convert to RGB
-                    frame = np.array(gif.convert('RGB'))
-                    frames.append(frame)
-                    gif.seek(gif.tell() + 1)
-            except EOFError:
-                pass  # End of GIF file
-        else:
-            # Load video using OpenCV
-            cap = cv2.VideoCapture(self.file_path)
+                    slot = free_slots.get()
+                    if slot is None:
+                        break  # Loading was abandoned
+                    # Decode directly into the ring buffer slot
+                    buffer = slots[slot]
+                    ret, image = cap.read(buffer)
+                    if not ret:
+                        break
+                    if not np.shares_memory(image, buffer):
+                        # OpenCV allocated a new image instead of filling the slot
+                        if image.shape != buffer.shape:
+                            raise ValueError(
+                                f"Decoded frame shape {image.shape} does not match the first "
+                                f"frame shape {buffer.shape} in {self.file_path}"
+                            )
+                        buffer[...] = image
+                    filled_slots.put(slot)
+            except Exception as e:
+                filled_slots.put(e)  # Re-raised by the loading thread
+            finally:
+                cap.release()
+                filled_slots.put(None)  # Signal end of stream
+        
+        reader = threading.Thread(target=read_frames, daemon=True)
+        reader.start()
+        
+        channel_min = volume[0].min(axis=(0, 1))
+        channel_max = volume[0].max(axis=(0, 1))
+        n_frames = 1
+        try:
             while True:
-                ret, frame = cap.read()
-                if not ret:
+                slot = filled_slots.get()
+                if slot is None:
                     break
-                # Convert from BGR to RGB
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frames.append(frame)
-            cap.release()
-        
-        if not frames:
-            raise ValueError(f"Could not load frames from {self.file_path}")
-            
-        return frames
+                if isinstance(slot, Exception):
+                    raise slot
+                if n_frames == len(volume):
+                    # Reported frame count was too low, grow the volume
+                    volume = np.concatenate([volume, np.empty_like(volume)])
+                # Convert from BGR to RGB while copying into the volume
+                frame = volume[n_frames]
+                frame[...] = slots[slot][..., ::-1]
+                free_slots.put(slot)
+                channel_min = np.minimum(channel_min, frame.min(axis=(0, 1)))
+                channel_max = np.maximum(channel_max, frame.max(axis=(0, 1)))
+                n_frames += 1
+        finally:
+            # Wake the reader if it is waiting for a slot so it always releases the capture
+            free_slots.put(None)
+            reader.join()
+        
+        return volume[:n_frames], channel_min, channel_max
         
     def dimension_changed(self, label):
         if self.anim is not None:
             self.anim.event_source.stop()
             self.anim = None  # Clear reference before creating a new one
         self.current_view = label
+        self._update_fn = self._update_fns[label]
         self.frame = 0  # Reset frame counter
         self.start_animation()  # Restart animation with new view
         
-    def update(self, frame):
-        self.frame = frame
-        
+    def _init_view(self):
+        """Create the artists for the current view that update() mutates each frame"""
         # Clear only the content, not the entire figure
         self.ax_2d.cla()
-        self.ax_3d.cla()
-        
-        # Set 3D view angle
-        self.ax_3d.view_init(elev=20, azim=45)
         
-        # Update based on selected view
         if self.current_view == 'X-Y-T':
             # 2D view: regular video playback
-            slice_data = self.volume[frame]
-            self.ax_2d.imshow(slice_data)
+            self._im = self.ax_2d.imshow(self.volume[0])
             self.ax_2d.set_xlabel('X')
             self.ax_2d.set_ylabel('Y')
-            self.ax_2d.set_title(f'Frame {frame} (X-Y plane)', pad=20)
-            plane_pos = frame / (self.time - 1) if self.time > 1 else 0  # Normalize to [0,1]
+            self.ax_2d.set_title('X-Y plane', pad=20)
             
         elif self.current_view == 'Y-T-X':
             # 2D view: vertical slice through time at fixed X
-            # For color, we'll take slices through each channel and combine
-            slice_data = np.zeros((self.time, self.height, 3))
-            for c in range(3):
-                slice_data[..., c] = self.volume[:, :, frame, c]
-            self.ax_2d.imshow(slice_data, aspect='auto')
+            self._im = self.ax_2d.imshow(self._vol_ytx[0], aspect='auto')
             self.ax_2d.set_xlabel('T')
             self.ax_2d.set_ylabel('Y')
-            self.ax_2d.set_title(f'X = {frame} (Y-T plane)', pad=20)
-            plane_pos = frame / (self.width - 1) if self.width > 1 else 0  # Normalize to [0,1]
+            self.ax_2d.set_title('Y-T plane', pad=20)
             
         else:  # T-X-Y
             # 2D view: horizontal slice through time at fixed Y
-            # For color, we'll take slices through each channel and combine
-            slice_data = np.zeros((self.time, self.width, 3))
-            for c in range(3):
-                slice_data[..., c] = self.volume[:, frame, :, c]
-            self.ax_2d.imshow(slice_data, aspect='auto')
+            self._im = self.ax_2d.imshow(self._vol_txy[0], aspect='auto')
             self.ax_2d.set_xlabel('X')
             self.ax_2d.set_ylabel('T')
-            self.ax_2d.set_title(f'Y = {frame} (T-X plane)', pad=20)
-            plane_pos = frame / (self.height - 1) if self.height > 1 else 0  # Normalize to [0,1]
+            self.ax_2d.set_title('T-X plane', pad=20)
         
         # Add grid to 2D view
         self.ax_2d.grid(True, alpha=0.3)
         
-        # Simple 3D visualization
-        self._setup_3d_axes()
-        self._plot_3d_box()
-        self._plot_simple_plane(self.current_view.split('-')[2], plane_pos)
+        # Frame label drawn inside the axes so blitting can redraw it cleanly
+        self._frame_label = self.ax_2d.text(
+            0.01, 0.99, '', transform=self.ax_2d.transAxes, ha='left', va='top',
+            fontsize=9, color='white', bbox=dict(facecolor='black', alpha=0.5, edgecolor='none')
+        )
         
-        plt.draw()
-        return self.ax_2d, self.ax_3d
+        # Replace the scanning plane with one for the new axis; when blitting, keep it
+        # animated so it is always drawn on top of the static cube
+        if self._plane_surf is not None:
+            self._plane_surf.remove()
+        self._plane_axis = self.current_view.split('-')[2]
+        self._plane_surf = self._plot_simple_plane(self._plane_axis, 0)
+        self._plane_surf.set_animated(self.fig.canvas.supports_blit)
+        self._plane_pos = None
+        
+    def _update_xyt(self, frame):
+        """Animation step for X-Y-T: regular video playback"""
+        return self._show_frame(frame, self.volume[frame], f'Frame {frame}', frame * self._inv_tm1)
+    
+    def _update_ytx(self, frame):
+        """Animation step for Y-T-X: vertical slice through time at fixed X"""
+        return self._show_frame(frame, self._vol_ytx[frame], f'X = {frame}', frame * self._inv_wm1)
+    
+    def _update_txy(self, frame):
+        """Animation step for T-X-Y: horizontal slice through time at fixed Y"""
+        return self._show_frame(frame, self._vol_txy[frame], f'Y = {frame}', frame * self._inv_hm1)
+    
+    def _show_frame(self, frame, slice_data, label, plane_pos):
+        """Push one frame into the reused artists and return them for blitting"""
+        self.frame = frame
+        
+        # Reuse the existing artists instead of rebuilding them
+        self._im.set_data(slice_data)
+        self._frame_label.set_text(label)
+        
+        # Redraw the 3D plane only on stride frames, and only when it visibly moves
+        if frame % self._3d_stride == 0 and (
+            self._plane_pos is None or abs(plane_pos - self._plane_pos) >= self._plane_min_step
+        ):
+            self._plane_pos = plane_pos
+            self._render_plane()
+        
+        # Blitting draws the image over the cached background, so redraw the grid on top;
+        # tick gridlines carry no axes of their own, which blitting needs to find them
+        gridlines = self.ax_2d.get_xgridlines() + self.ax_2d.get_ygridlines()
+        for line in gridlines:
+            if line.axes is None:
+                line.axes = self.ax_2d
+        return (self._im, *gridlines, self._frame_label)
+    
+    def _on_draw(self, event):
+        """Cache the static 3D background after a full redraw and put the plane back on top"""
+        canvas = event.canvas
+        if canvas.is_saving():
+            return
+        
+        # Roughly one pixel of the 3D axes at the current size and dpi
+        bbox = self.ax_3d.bbox
+        self._plane_min_step = 1.0 / max(min(bbox.width, bbox.height), 1.0)
+        
+        if not canvas.supports_blit:
+            # Without blitting the plane is drawn along with the rest of the figure
+            self._bg_3d = None
+            if self._plane_surf is not None and self._plane_surf.get_animated():
+                self._plane_surf.set_animated(False)
+                self.ax_3d.draw_artist(self._plane_surf)
+            return
+        self._bg_3d = canvas.copy_from_bbox(self.ax_3d.bbox)
+        if self._plane_surf is not None:
+            self.ax_3d.draw_artist(self._plane_surf)
+    
+    def _render_plane(self):
+        """Move the scanning plane and blit just the 3D axes, adapting the redraw stride"""
+        start = time.perf_counter()
+        self._move_plane(self._plane_axis, self._plane_pos)
+        if self._bg_3d is None:
+            return  # Drawn on the next full redraw instead
+        
+        canvas = self.fig.canvas
+        canvas.restore_region(self._bg_3d)
+        self.ax_3d.draw_artist(self._plane_surf)
+        canvas.blit(self.ax_3d.bbox)
+        
+        cost = time.perf_counter() - start
+        self._3d_cost = cost if self._3d_cost is None else 0.8 * self._3d_cost + 0.2 * cost
+        budget = self._3d_budget * self.interval / 1000
+        self._3d_stride = int(min(max(np.ceil(self._3d_cost / budget), 1), self._3d_max_stride))
     
     def _setup_3d_axes(self):
         """Setup 3D axes with proper scaling and ticks"""
@@ -200,20 +415,11 @@ class SpaceTimeVisualizer:
     
     def _plot_3d_box(self):
         """Plot unit cube wireframe"""
-        # Plot vertices
-        x = np.array([0, 1])
-        y = np.array([0, 1])
-        z = np.array([0, 1])
-        
-        # Create box edges with thinner lines
-        for i in [0, 1]:
-            for j in [0, 1]:
-                self.ax_3d.plot([x[0], x[1]], [y[j], y[j]], [z[i], z[i]], 'b-', alpha=0.2, linewidth=0.5)
-                self.ax_3d.plot([x[j], x[j]], [y[0], y[1]], [z[i], z[i]], 'b-', alpha=0.2, linewidth=0.5)
-                self.ax_3d.plot([x[j], x[j]], [y[i], y[i]], [z[0], z[1]], 'b-', alpha=0.2, linewidth=0.5)
+        # Draw all box edges as a single collection with thinner lines
+        self.ax_3d.add_collection3d(Line3DCollection(self._box_edges, colors='b', alpha=0.2, linewidths=0.5))
     
-    def _plot_simple_plane(self, axis, value):
-        """Plot a simple scanning plane in unit cube"""
+    def _plane_mesh(self, axis, value):
+        """Return the X, Y, Z mesh of the scanning plane in unit cube"""
         # Create a finer mesh for the plane
         u = np.linspace(0, 1, 2)
         v = np.linspace(0, 1, 2)
@@ -229,8 +435,25 @@ class SpaceTimeVisualizer:
             X, Z = U, V
             Y = np.full_like(X, value)
         
+        return X, Y, Z
+    
+    def _plot_simple_plane(self, axis, value):
+        """Plot a simple scanning plane in unit cube"""
+        X, Y, Z = self._plane_mesh(axis, value)
+        
         # Plot the plane with higher alpha for visibility
-        surf = self.ax_3d.plot_surface(X, Y, Z, color='red', alpha=0.5)
+        return self.ax_3d.plot_surface(X, Y, Z, color='red', alpha=0.5)
+    
+    def _move_plane(self, axis, value):
+        """Move the existing scanning plane instead of plotting a new one"""
+        X, Y, Z = self._plane_mesh(axis, value)
+        
+        # Walk the 2x2 mesh corners in order to form a single quad
+        corners = np.stack([X, Y, Z], axis=-1)[[0, 0, 1, 1], [0, 1, 1, 0]]
+        self._plane_surf.set_verts([corners])
+        
+        # Reproject now since blitting draws the artist without a full axes draw
+        self._plane_surf.do_3d_projection()
     
     def update_fps_from_textbox(self, text):
         """Update FPS from text input"""
@@ -272,9 +495,12 @@ class SpaceTimeVisualizer:
         else:  # T-X-Y
             frames = self.height
             
+        # Build the artists once; update() only changes their data
+        self._init_view()
+        
         # Create new animation and keep reference to prevent garbage collection
-        self.anim = FuncAnimation(self.fig, self.update, frames=frames,
-                                interval=self.interval, blit=False)
+        self.anim = FuncAnimation(self.fig, self._update_fn, frames=frames,
+                                interval=self.interval, blit=True)
         plt.draw()
         
         # Store reference to animation to prevent deletion warning
@@ -294,34 +520,21 @@ class SpaceTimeVisualizer:
         self.fig.canvas.draw_idle()
         
         try:
-            # Export the current view
+            # Export the current view straight from the uint8 source frames, passing a
+            # transposed view; the GIF encoder still converts and holds every frame
             if self.current_view == 'X-Y-T':
-                frames = self.time
-                data = self.volume
+                data = self.volume_u8
             elif self.current_view == 'Y-T-X':
-                frames = self.width
-                data = np.zeros((frames, self.time, self.height, 3))
-                for x in range(frames):
-                    for c in range(3):
-                        data[x, :, :, c] = self.volume[:, :, x, c]
+                data = self.volume_u8.transpose(2, 0, 1, 3)
             else:  # T-X-Y
-                frames = self.height
-                data = np.zeros((frames, self.time, self.width, 3))
-                for y in range(frames):
-                    for c in range(3):
-                        data[y, :, :, c] = self.volume[:, y, :, c]
-
-            # Convert float array back to uint8 for saving
-            data = (data * 255).astype(np.uint8)
+                data = self.volume_u8.transpose(1, 0, 2, 3)
             
             # Calculate duration in ms based on current FPS
             duration = int(1000 / self.fps)
             
-            # Save frames as GIF with current FPS
-            with imageio.get_writer(output_path, mode='I', duration=duration) as writer:
-                for i in range(frames):
-                    frame = data[i]
-                    writer.append_data(frame)
+            # Save as GIF with current FPS; the pillow plugin converts frame by frame
+            # and keeps them all until the file is written
+            iio.imwrite(output_path, data, duration=duration, plugin='pillow')
             
             # Update button text to show success
             self.button.label.set_text('Export Complete!')
@@ -332,9 +545,15 @@ class SpaceTimeVisualizer:
             self.button.label.set_text('Export Failed!')
             print(f"Export failed: {str(e)}")
         
-        # Reset button text after 2 seconds
+        # Reset button text after 2 seconds without blocking the event loop
         self.fig.canvas.draw_idle()
-        plt.pause(2)
+        self._reset_timer = self.fig.canvas.new_timer(interval=2000)
+        self._reset_timer.single_shot = True
+        self._reset_timer.add_callback(self._reset_export_button)
+        self._reset_timer.start()
+    
+    def _reset_export_button(self):
+        """Restore the export button label after an export finishes"""
         self.button.label.set_text('Export GIF')
         self.fig.canvas.draw_idle()
 